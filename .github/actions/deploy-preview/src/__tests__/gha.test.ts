@@ -1,4 +1,28 @@
-import { postOrUpdatePrComment } from '../gha'
+jest.mock('@actions/core', () => ({
+  debug: jest.fn(),
+  isDebug: jest.fn(),
+  info: jest.fn(),
+  warning: jest.fn(),
+  summary: {
+    addRaw: jest.fn(),
+    isEmptyBuffer: jest.fn(),
+    stringify: jest.fn(),
+    emptyBuffer: jest.fn(),
+    write: jest.fn(),
+  },
+}))
+
+import * as core from '@actions/core'
+import {
+  debugContent,
+  flushSummary,
+  notifyArgoCdWebhook,
+  postOrUpdatePrComment,
+  rateLimitDelayMs,
+  retryWithBackoff,
+  signWebhookBody,
+  writeSummary,
+} from '../gha'
 
 const MARKER = '<!-- akpe-preview -->'
 
@@ -62,3 +86,194 @@ describe('postOrUpdatePrComment', () => {
     expect(call.body).toMatch(new RegExp(`^${MARKER.replace(/[<>!-]/g, '\\$&')}`))
   })
 })
+
+describe('rateLimitDelayMs', () => {
+  it('honors Retry-After in seconds', () => {
+    expect(rateLimitDelayMs({ 'retry-after': '30' })).toBe(30_000)
+  })
+
+  it('waits until reset when the budget is exhausted', () => {
+    const now = 1_000_000
+    const headers = { 'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '1005' }
+    expect(rateLimitDelayMs(headers, now)).toBe(5_000)
+  })
+
+  it('ignores a Retry-After given as an HTTP date', () => {
+    expect(rateLimitDelayMs({ 'retry-after': 'Wed, 21 Oct 2026 07:28:00 GMT' })).toBeUndefined()
+  })
+
+  it('returns undefined without rate-limit headers', () => {
+    expect(rateLimitDelayMs({ 'x-ratelimit-remaining': '42' })).toBeUndefined()
+  })
+})
+
+describe('retryWithBackoff', () => {
+  const sleep = jest.fn().mockResolvedValue(undefined)
+
+  beforeEach(() => sleep.mockClear())
+
+  it('returns the first successful result', async () => {
+    const fn = jest.fn().mockRejectedValueOnce({ status: 409 }).mockResolvedValue('ok')
+    await expect(retryWithBackoff(fn, { maxAttempts: 3, sleep })).resolves.toBe('ok')
+    expect(fn).toHaveBeenCalledTimes(2)
+    expect(fn).toHaveBeenLastCalledWith(2)
+  })
+
+  it('backs off exponentially with jitter', async () => {
+    const fn = jest.fn().mockRejectedValue({ status: 409 })
+    await expect(retryWithBackoff(fn, { maxAttempts: 3, sleep })).rejects.toEqual({ status: 409 })
+    const [first, second] = sleep.mock.calls.map(([ms]) => ms)
+    expect(first).toBeGreaterThanOrEqual(1000)
+    expect(first).toBeLessThan(2000)
+    expect(second).toBeGreaterThanOrEqual(2000)
+    expect(second).toBeLessThan(3000)
+  })
+
+  it('sleeps for Retry-After on secondary rate limits', async () => {
+    const fn = jest
+      .fn()
+      .mockRejectedValueOnce({ status: 403, response: { headers: { 'retry-after': '2' } } })
+      .mockResolvedValue('ok')
+    await retryWithBackoff(fn, { maxAttempts: 3, sleep })
+    expect(sleep).toHaveBeenCalledWith(2000)
+  })
+
+  it('backs off on a rate-limit 403 whose Retry-After is an HTTP date', async () => {
+    const headers = { 'retry-after': 'Wed, 21 Oct 2026 07:28:00 GMT' }
+    const fn = jest
+      .fn()
+      .mockRejectedValueOnce({ status: 403, response: { headers } })
+      .mockResolvedValue('ok')
+    await expect(retryWithBackoff(fn, { maxAttempts: 3, sleep })).resolves.toBe('ok')
+    const [[delay]] = sleep.mock.calls
+    expect(delay).toBeGreaterThanOrEqual(1000)
+    expect(delay).toBeLessThan(2000)
+  })
+
+  it('does not retry a plain 403', async () => {
+    const fn = jest.fn().mockRejectedValue({ status: 403, response: { headers: {} } })
+    await expect(retryWithBackoff(fn, { maxAttempts: 3, sleep })).rejects.toEqual({
+      status: 403,
+      response: { headers: {} },
+    })
+    expect(fn).toHaveBeenCalledTimes(1)
+  })
+
+  it('uses a per-status attempt budget when one is given', async () => {
+    const fn = jest.fn().mockRejectedValue({ status: 409 })
+    const options = { maxAttempts: 2, maxAttemptsByStatus: { 409: 4 }, sleep }
+    await expect(retryWithBackoff(fn, options)).rejects.toEqual({ status: 409 })
+    expect(fn).toHaveBeenCalledTimes(4)
+  })
+
+  it('does not retry statuses outside retryOn', async () => {
+    const fn = jest.fn().mockRejectedValue({ status: 500 })
+    await expect(retryWithBackoff(fn, { maxAttempts: 3, sleep })).rejects.toEqual({ status: 500 })
+    expect(sleep).not.toHaveBeenCalled()
+  })
+})
+
+describe('writeSummary / flushSummary', () => {
+  const summary = core.summary as unknown as Record<string, jest.Mock>
+
+  beforeEach(() => jest.clearAllMocks())
+
+  afterEach(() => {
+    delete process.env.GITHUB_STEP_SUMMARY
+  })
+
+  it('buffers markdown without touching the summary file', () => {
+    writeSummary('## hello')
+    expect(summary.addRaw).toHaveBeenCalledWith('## hello', true)
+    expect(summary.write).not.toHaveBeenCalled()
+  })
+
+  it('writes the buffer once on flush', async () => {
+    process.env.GITHUB_STEP_SUMMARY = '/tmp/summary.md'
+    summary.isEmptyBuffer.mockReturnValue(false)
+    await flushSummary()
+    expect(summary.write).toHaveBeenCalledTimes(1)
+  })
+
+  it('does nothing when the buffer is empty', async () => {
+    process.env.GITHUB_STEP_SUMMARY = '/tmp/summary.md'
+    summary.isEmptyBuffer.mockReturnValue(true)
+    await flushSummary()
+    expect(summary.write).not.toHaveBeenCalled()
+  })
+
+  it('logs the buffer when GITHUB_STEP_SUMMARY is not set', async () => {
+    summary.isEmptyBuffer.mockReturnValue(false)
+    summary.stringify.mockReturnValue('## hello\n')
+    await flushSummary()
+    expect(core.info).toHaveBeenCalledWith('## hello\n')
+    expect(summary.emptyBuffer).toHaveBeenCalled()
+    expect(summary.write).not.toHaveBeenCalled()
+  })
+})
+
+describe('notifyArgoCdWebhook', () => {
+  const fetchMock = jest.fn()
+  const originalFetch = global.fetch
+
+  beforeEach(() => {
+    jest.clearAllMocks()
+    global.fetch = fetchMock as unknown as typeof fetch
+  })
+
+  afterEach(() => {
+    global.fetch = originalFetch
+  })
+
+  it('posts a signed GitHub push event', async () => {
+    fetchMock.mockResolvedValue({ ok: true, status: 200 })
+    const payload = { ref: 'refs/heads/main' }
+    await notifyArgoCdWebhook('https://argocd/api/webhook', 'secret', payload)
+    const [url, init] = fetchMock.mock.calls[0]
+    expect(url).toBe('https://argocd/api/webhook')
+    expect(init.method).toBe('POST')
+    expect(init.body).toBe(JSON.stringify(payload))
+    expect(init.headers['x-github-event']).toBe('push')
+    expect(init.headers['x-hub-signature-256']).toBe(signWebhookBody('secret', init.body))
+  })
+
+  it('omits the signature without a secret', async () => {
+    fetchMock.mockResolvedValue({ ok: true, status: 200 })
+    await notifyArgoCdWebhook('https://argocd/api/webhook', '', {})
+    expect(fetchMock.mock.calls[0][1].headers['x-hub-signature-256']).toBeUndefined()
+  })
+
+  it('warns instead of throwing on network errors', async () => {
+    fetchMock.mockRejectedValue(new Error('ECONNREFUSED'))
+    await expect(notifyArgoCdWebhook('https://argocd/api/webhook', '', {})).resolves.toBeUndefined()
+    expect(core.warning).toHaveBeenCalledWith(expect.stringContaining('ECONNREFUSED'))
+  })
+
+  it('warns on non-2xx responses', async () => {
+    fetchMock.mockResolvedValue({ ok: false, status: 400 })
+    await notifyArgoCdWebhook('https://argocd/api/webhook', '', {})
+    expect(core.warning).toHaveBeenCalledWith(expect.stringContaining('HTTP 400'))
+  })
+})
+
+describe('signWebhookBody', () => {
+  it('produces a sha256= prefixed HMAC hex digest', () => {
+    expect(signWebhookBody('key', 'body')).toMatch(/^sha256=[0-9a-f]{64}$/)
+  })
+})
+
+describe('debugContent', () => {
+  beforeEach(() => jest.clearAllMocks())
+
+  it('skips core.debug when debug logging is off', () => {
+    ;(core.isDebug as jest.Mock).mockReturnValue(false)
+    debugContent('services: []')
+    expect(core.debug).not.toHaveBeenCalled()
+  })
+
+  it('forwards to core.debug when debug logging is on', () => {
+    ;(core.isDebug as jest.Mock).mockReturnValue(true)
+    debugContent('services: []')
+    expect(core.debug).toHaveBeenCalledWith('services: []')
+  })
+})
@@ -8,13 +8,23 @@ jest.mock('@actions/core', () => ({
 
 jest.mock('@actions/github')
 
-const mockPostOrUpdatePrComment = jest.fn().mockResolvedValue(undefined)
-jest.mock('../gha', () => ({
-  startGroup: jest.fn(),
-  endGroup: jest.fn(),
-  writeSummary: jest.fn().mockResolvedValue(undefined),
-  postOrUpdatePrComment: mockPostOrUpdatePrComment,
-}))
+const mockPostOrUpdatePrComment = jest.fn()
+const mockNotifyArgoCdWebhook = jest.fn()
+jest.mock('../gha', () => {
+  const actual = jest.requireActual('../gha')
+  return {
+    debugContent: jest.fn(),
+    startGroup: jest.fn(),
+    endGroup: jest.fn(),
+    writeSummary: jest.fn(),
+    postOrUpdatePrComment: mockPostOrUpdatePrComment,
+    notifyArgoCdWebhook: mockNotifyArgoCdWebhook,
+    isRateLimited: actual.isRateLimited,
+    rateLimitDelayMs: actual.rateLimitDelayMs,
+    retryWithBackoff: (fn: () => Promise<unknown>, options: object) =>
+      actual.retryWithBackoff(fn, { ...options, sleep: () => Promise.resolve() }),
+  }
+})
 
 import * as core from '@actions/core'
 import * as github from '@actions/github'
@@ -39,26 +49,71 @@ const SERVICES_YAML = yaml.dump({
   serviceRepos: { 'backend-1': {}, 'backend-2': {}, front: {} },
 })
 
-function makeOctokit({ commitUrl = 'https://github.com/owner/gitops/commit/xyz' } = {}) {
-  const getContent = jest.fn().mockImplementation(({ path }: { path: string }) => {
-    if (path === 'services.yaml') {
-      return Promise.resolve({
-        data: { type: 'file', content: Buffer.from(SERVICES_YAML).toString('base64'), sha: 'sha-svc' },
-      })
-    }
-    // preview file not found → new preview
-    return Promise.reject({ status: 404 })
-  })
+interface HistoryNode {
+  oid: string
+  url: string
+  message: string
+  parents: { nodes: { oid: string }[] }
+}
 
-  const createOrUpdateFileContents = jest.fn().mockResolvedValue({
-    data: { commit: { html_url: commitUrl } },
+function snapshotResponse({
+  existingValues = undefined as string | undefined,
+  servicesYaml = SERVICES_YAML as string | null,
+  history = [] as HistoryNode[],
+} = {}) {
+  return {
+    repository: {
+      url: 'https://github.com/owner/gitops',
+      defaultBranchRef: {
+        name: 'main',
+        target: {
+          oid: 'head-sha',
+          url: 'https://github.com/owner/gitops/commit/head-sha',
+          tree: { oid: 'tree-sha' },
+          services:
+            servicesYaml !== null ? { object: { oid: 'sha-svc', text: servicesYaml } } : null,
+          // values null → new preview
+          values:
+            existingValues !== undefined
+              ? { object: { oid: 'sha-v', text: existingValues } }
+              : null,
+          history: { nodes: history },
+        },
+      },
+    },
+  }
+}
+
+function makeOctokit({
+  commitUrl = 'https://github.com/owner/gitops/commit/xyz',
+  existingValues = undefined as string | undefined,
+  servicesYaml = SERVICES_YAML,
+} = {}) {
+  const graphql = jest.fn().mockResolvedValue(snapshotResponse({ existingValues, servicesYaml }))
+
+  const createBlob = jest.fn().mockResolvedValue({ data: { sha: 'blob-sha' } })
+  const createTree = jest.fn().mockResolvedValue({ data: { sha: 'new-tree-sha' } })
+  const createCommit = jest.fn().mockResolvedValue({
+    data: { sha: 'new-commit-sha', html_url: commitUrl },
   })
+  const updateRef = jest.fn().mockResolvedValue({ data: {} })
 
-  return { rest: { repos: { getContent, createOrUpdateFileContents } } }
+  return {
+    graphql,
+    rest: {
+      git: { createBlob, createTree, createCommit, updateRef },
+    },
+  }
 }
 
 describe('main', () => {
-  beforeEach(() => jest.clearAllMocks())
+  beforeEach(() => {
+    jest.clearAllMocks()
+    mockPostOrUpdatePrComment.mockResolvedValue(undefined)
+    mockNotifyArgoCdWebhook.mockResolvedValue(undefined)
+  })
+
+  afterEach(() => jest.restoreAllMocks())
 
   it('emits preview-slug output on success', async () => {
     ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
@@ -93,6 +148,302 @@ describe('main', () => {
     )
   })
 
+  it('commits on top of the default branch head and fast-forwards the ref', async () => {
+    const octokit = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.rest.git.createTree).toHaveBeenCalledWith(
+      expect.objectContaining({
+        base_tree: 'tree-sha',
+        tree: [
+          {
+            path: 'previews/feature-my-branch/values.yaml',
+            mode: '100644',
+            type: 'blob',
+            sha: 'blob-sha',
+          },
+        ],
+      }),
+    )
+    expect(octokit.rest.git.createCommit).toHaveBeenCalledWith(
+      expect.objectContaining({ tree: 'new-tree-sha', parents: ['head-sha'] }),
+    )
+    expect(octokit.rest.git.updateRef).toHaveBeenCalledWith(
+      expect.objectContaining({ ref: 'heads/main', sha: 'new-commit-sha' }),
+    )
+  })
+
+  it('re-reads the branch head and retries when the ref update conflicts', async () => {
+    const octokit = makeOctokit()
+    octokit.rest.git.updateRef.mockRejectedValueOnce({ status: 422 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.graphql).toHaveBeenCalledTimes(2)
+    expect(octokit.rest.git.updateRef).toHaveBeenCalledTimes(2)
+  })
+
+  it('does not retry validation errors from the Git Data API', async () => {
+    const octokit = makeOctokit()
+    octokit.rest.git.createTree.mockRejectedValue({ status: 422 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toEqual({ status: 422 })
+    expect(octokit.rest.git.createTree).toHaveBeenCalledTimes(1)
+    expect(octokit.rest.git.updateRef).not.toHaveBeenCalled()
+  })
+
+  it('retries a transient failure on the first snapshot read', async () => {
+    const octokit = makeOctokit()
+    octokit.graphql.mockRejectedValueOnce({ status: 502 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.graphql).toHaveBeenCalledTimes(2)
+    expect(octokit.rest.git.updateRef).toHaveBeenCalledTimes(1)
+  })
+
+  it('checks the catalog again on every attempt', async () => {
+    const octokit = makeOctokit()
+    const servicesYaml = yaml.dump({ serviceRepos: { front: {} } })
+    octokit.graphql
+      .mockResolvedValueOnce(snapshotResponse())
+      .mockResolvedValueOnce(snapshotResponse({ servicesYaml }))
+    octokit.rest.git.updateRef.mockRejectedValueOnce({ status: 422 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toThrow("Service 'backend-1' not found")
+  })
+
+  it('pins several services in a single commit', async () => {
+    const octokit = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main({
+      ...testInputs,
+      serviceUpdates: [
+        { name: 'backend-1', commitSha: 'sha1' },
+        { name: 'front', commitSha: 'sha3' },
+      ],
+    })
+    expect(octokit.rest.git.createCommit).toHaveBeenCalledTimes(1)
+    const content = octokit.rest.git.createBlob.mock.calls[0][0].content
+    const values = yaml.load(content) as { services: { name: string; commitSha?: string }[] }
+    expect(values.services.map((s) => s.commitSha)).toEqual(['sha1', undefined, 'sha3'])
+  })
+
+  it('gives up after repeated ref conflicts', async () => {
+    const octokit = makeOctokit()
+    octokit.rest.git.updateRef.mockRejectedValue({ status: 422 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toThrow('Failed to push after 5 attempts')
+    expect(octokit.rest.git.updateRef).toHaveBeenCalledTimes(5)
+  })
+
+  it('keeps retrying while pushes to other previews move the branch', async () => {
+    const octokit = makeOctokit()
+    // Each attempt sees a new head: another preview was pushed in between
+    for (let i = 1; i <= 4; i++) {
+      const snapshot = snapshotResponse()
+      snapshot.repository.defaultBranchRef.target.oid = `head-sha-${i}`
+      octokit.graphql.mockResolvedValueOnce(snapshot)
+    }
+    octokit.rest.git.updateRef
+      .mockRejectedValueOnce({ status: 422 })
+      .mockRejectedValueOnce({ status: 422 })
+      .mockRejectedValueOnce({ status: 422 })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.rest.git.updateRef).toHaveBeenCalledTimes(4)
+    expect(octokit.rest.git.createCommit).toHaveBeenLastCalledWith(
+      expect.objectContaining({ parents: ['head-sha-4'] }),
+    )
+  })
+
+  it('keeps unquoted timestamps in existing values as strings', async () => {
+    const existingValues = [
+      'services:',
+      '  - name: backend-1',
+      '    commitSha: old',
+      '    metadata:',
+      '      created-at: 2026-01-01T00:00:00Z',
+      '',
+    ].join('\n')
+    const octokit = makeOctokit({ existingValues })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    const content = octokit.rest.git.createBlob.mock.calls[0][0].content
+    expect(content).toContain("created-at: '2026-01-01T00:00:00Z'")
+  })
+
+  it('skips the push when values.yaml is unchanged', async () => {
+    const first = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockReturnValue(first)
+    await main(testInputs)
+    const existingValues = first.rest.git.createBlob.mock.calls[0][0].content
+
+    jest.clearAllMocks()
+    const octokit = makeOctokit({ existingValues })
+    const lastWrite = {
+      oid: 'values-sha',
+      url: 'https://github.com/owner/gitops/commit/values-sha',
+      message: 'chore(preview): create feature-my-branch preview',
+      parents: { nodes: [{ oid: 'older-sha' }] },
+    }
+    octokit.graphql.mockResolvedValue(snapshotResponse({ existingValues, history: [lastWrite] }))
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.rest.git.createBlob).not.toHaveBeenCalled()
+    expect(octokit.rest.git.updateRef).not.toHaveBeenCalled()
+    expect(core.notice).toHaveBeenCalledWith(expect.stringContaining('skipping push'))
+    // The last commit that wrote values.yaml, not the unrelated branch head
+    expect(core.setOutput).toHaveBeenCalledWith(
+      'gitops-commit-url',
+      'https://github.com/owner/gitops/commit/values-sha',
+    )
+  })
+
+  it('notifies the ArgoCD webhook with a push event after pushing', async () => {
+    ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
+    const argocdWebhookUrl = 'https://argocd.example.com/api/webhook'
+    await main({ ...testInputs, argocdWebhookUrl, argocdWebhookSecret: 's3cret' })
+    expect(mockNotifyArgoCdWebhook).toHaveBeenCalledWith(
+      argocdWebhookUrl,
+      's3cret',
+      expect.objectContaining({
+        ref: 'refs/heads/main',
+        before: 'head-sha',
+        after: 'new-commit-sha',
+        repository: { html_url: 'https://github.com/owner/gitops', default_branch: 'main' },
+      }),
+    )
+  })
+
+  it('posts PR comments without waiting for the ArgoCD webhook', async () => {
+    ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
+    const events: string[] = []
+    mockNotifyArgoCdWebhook.mockImplementationOnce(async () => {
+      await new Promise((resolve) => setImmediate(resolve))
+      events.push('webhook')
+    })
+    mockPostOrUpdatePrComment.mockImplementationOnce(async () => {
+      events.push('comment')
+    })
+    await main({ ...testInputs, argocdWebhookUrl: 'https://argocd.example.com/api/webhook' })
+    expect(events).toEqual(['comment', 'webhook'])
+  })
+
+  it('comments once on a PR shared by several updated services', async () => {
+    ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
+    await main({
+      ...testInputs,
+      serviceUpdates: [
+        { name: 'backend-1', commitSha: 'sha1' },
+        { name: 'front', commitSha: 'sha3' },
+      ],
+    })
+    expect(mockPostOrUpdatePrComment).toHaveBeenCalledTimes(1)
+  })
+
+  it('does not notify the ArgoCD webhook when not configured', async () => {
+    ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
+    await main(testInputs)
+    expect(mockNotifyArgoCdWebhook).not.toHaveBeenCalled()
+  })
+
+  it('reads the branch head and both files in a single GraphQL query', async () => {
+    const octokit = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.graphql).toHaveBeenCalledTimes(1)
+    expect(octokit.graphql).toHaveBeenCalledWith(expect.any(String), {
+      owner: 'owner',
+      repo: 'gitops',
+      valuesPath: 'previews/feature-my-branch/values.yaml',
+    })
+  })
+
+  it('throws when services.yaml is missing', async () => {
+    const octokit = makeOctokit()
+    octokit.graphql.mockResolvedValue(snapshotResponse({ servicesYaml: null }))
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toThrow('services.yaml not found in owner/gitops')
+  })
+
+  it('tags the gitops commit with an idempotency key trailer', async () => {
+    const octokit = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    const { message } = octokit.rest.git.createCommit.mock.calls[0][0]
+    expect(message).toContain('chore(preview): create feature-my-branch preview\n\n')
+    expect(message).toMatch(/\nIdempotency-Key: [0-9a-f]{16}$/)
+  })
+
+  it('does not commit again when a failed attempt had actually landed', async () => {
+    const octokit = makeOctokit()
+    octokit.rest.git.updateRef.mockRejectedValueOnce({ status: 502 })
+    octokit.graphql.mockResolvedValueOnce(snapshotResponse()).mockImplementationOnce(async () => {
+      const { message } = octokit.rest.git.createCommit.mock.calls[0][0]
+      const landed = {
+        oid: 'landed-sha',
+        url: 'https://github.com/owner/gitops/commit/landed-sha',
+        message,
+        parents: { nodes: [{ oid: 'head-sha' }] },
+      }
+      return snapshotResponse({ history: [landed] })
+    })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await main(testInputs)
+    expect(octokit.rest.git.createCommit).toHaveBeenCalledTimes(1)
+    expect(core.setOutput).toHaveBeenCalledWith(
+      'gitops-commit-url',
+      'https://github.com/owner/gitops/commit/landed-sha',
+    )
+  })
+
+  it('comments on the triggering PR with the source token before fanning out', async () => {
+    const srcOctokit = makeOctokit()
+    const gitopsOctokit = makeOctokit()
+    ;(github.getOctokit as jest.Mock).mockImplementation((token: string) =>
+      token === 'gh-token' ? srcOctokit : gitopsOctokit,
+    )
+    jest.replaceProperty(github, 'context', {
+      repo: { owner: 'owner', repo: 'akpe-backend-1' },
+    } as never)
+    await main({ ...testInputs, githubToken: 'gh-token' })
+    expect(mockPostOrUpdatePrComment).toHaveBeenCalledTimes(2)
+    const [first, second] = mockPostOrUpdatePrComment.mock.calls
+    expect(first.slice(0, 4)).toEqual([srcOctokit, 'owner', 'akpe-backend-1', 1])
+    expect(second.slice(0, 4)).toEqual([gitopsOctokit, 'owner', 'akpe-backend-1', 1])
+  })
+
+  it('warns instead of failing when the triggering PR cannot be commented', async () => {
+    ;(github.getOctokit as jest.Mock).mockReturnValue(makeOctokit())
+    jest.replaceProperty(github, 'context', {
+      repo: { owner: 'owner', repo: 'akpe-backend-1' },
+    } as never)
+    mockPostOrUpdatePrComment.mockRejectedValueOnce(new Error('Resource not accessible'))
+    const argocdWebhookUrl = 'https://argocd.example.com/api/webhook'
+    await main({ ...testInputs, githubToken: 'gh-token', argocdWebhookUrl })
+    expect(core.warning).toHaveBeenCalledWith(
+      'Could not comment on owner/akpe-backend-1#1: Resource not accessible',
+    )
+    expect(mockNotifyArgoCdWebhook).toHaveBeenCalledTimes(1)
+    expect(mockPostOrUpdatePrComment).toHaveBeenCalledTimes(2)
+  })
+
+  it('reports an exhausted rate limit instead of missing write access', async () => {
+    const octokit = makeOctokit()
+    const headers = { 'x-ratelimit-remaining': '0', 'x-ratelimit-reset': '4102444800' }
+    octokit.rest.git.createBlob.mockRejectedValue({ status: 403, response: { headers } })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toThrow(
+      'GitHub API rate limit exceeded for owner/gitops (resets at 2100-01-01T00:00:00.000Z)',
+    )
+  })
+
+  it('reports a plain 403 as missing write access', async () => {
+    const octokit = makeOctokit()
+    octokit.rest.git.createBlob.mockRejectedValue({ status: 403, response: { headers: {} } })
+    ;(github.getOctokit as jest.Mock).mockReturnValue(octokit)
+    await expect(main(testInputs)).rejects.toThrow('GITOPS_TOKEN lacks write access')
+  })
+
   it('throws when gitops-repo is malformed', async () => {
     await expect(main({ ...testInputs, gitopsRepo: 'invalid' })).rejects.toThrow(
       "GITOPS_REPO must be set in 'owner/repo' format.",
@@ -0,0 +1,484 @@
+import {
+  buildPreviewValues,
+  buildServiceMetadata,
+  buildSummary,
+  dumpYaml,
+  formatSummaryRow,
+  idempotencyKey,
+  parseCatalog,
+  parsePrUrl,
+  parseServiceUpdates,
+  parseYaml,
+  readIdempotencyKey,
+  resolveServiceUpdates,
+  slugify,
+  updatePreviewValues,
+} from '../preview'
+import { ActionInputs, PreviewValues } from '../types'
+
+const testInputs: ActionInputs = {
+  gitopsRepo: 'owner/gitops',
+  gitopsToken: 'token',
+  serviceName: 'backend-1',
+  headRef: 'feature/my-branch',
+  commitSha: 'abc123def456',
+  prAuthor: 'dev',
+  prUrl: 'https://github.com/owner/repo/pull/1',
+  prNumber: '1',
+  timestamp: '2026-02-20T10:00:00Z',
+  workflowRunUrl: 'https://github.com/owner/repo/actions/runs/123',
+}
+
+const testMetadata = buildServiceMetadata(testInputs)
+
+describe('slugify', () => {
+  it('lowercases and replaces non-alphanumeric with hyphens', () => {
+    expect(slugify('feature/my-branch')).toBe('feature-my-branch')
+  })
+
+  it('collapses multiple hyphens', () => {
+    expect(slugify('feat--double')).toBe('feat-double')
+  })
+
+  it('strips leading and trailing hyphens', () => {
+    expect(slugify('-branch-')).toBe('branch')
+  })
+
+  it('handles uppercase', () => {
+    expect(slugify('UPPER_CASE')).toBe('upper-case')
+  })
+
+  it('handles slashes', () => {
+    expect(slugify('feature/some/nested')).toBe('feature-some-nested')
+  })
+
+  it('collapses runs of mixed separators', () => {
+    expect(slugify('feat//some__thing')).toBe('feat-some-thing')
+  })
+
+  it('handles already-clean slug', () => {
+    expect(slugify('my-branch')).toBe('my-branch')
+  })
+})
+
+describe('buildPreviewValues', () => {
+  it('creates entries for all catalog services', () => {
+    const result = buildPreviewValues(
+      'feature-my-branch',
+      [{ name: 'backend-1', commitSha: 'abc123' }],
+      ['backend-1', 'backend-2', 'front'],
+      testMetadata,
+    )
+    expect(result.services).toHaveLength(3)
+  })
+
+  it('pins commitSha only for the target service', () => {
+    const result = buildPreviewValues(
+      'slug',
+      [{ name: 'backend-1', commitSha: 'abc123' }],
+      ['backend-1', 'backend-2'],
+      testMetadata,
+    )
+    expect(result.services.find((s) => s.name === 'backend-1')?.commitSha).toBe('abc123')
+    expect(result.services.find((s) => s.name === 'backend-2')?.commitSha).toBeUndefined()
+  })
+
+  it('sets metadata only for the target service', () => {
+    const result = buildPreviewValues(
+      'slug',
+      [{ name: 'backend-1', commitSha: 'sha' }],
+      ['backend-1', 'backend-2'],
+      testMetadata,
+    )
+    expect(result.services.find((s) => s.name === 'backend-1')?.metadata).toBeDefined()
+    expect(result.services.find((s) => s.name === 'backend-2')?.metadata).toBeUndefined()
+  })
+
+  it('preserves catalog order', () => {
+    const catalog = ['front', 'backend-1', 'backend-2']
+    const result = buildPreviewValues(
+      'slug',
+      [{ name: 'backend-1', commitSha: 'sha' }],
+      catalog,
+      testMetadata,
+    )
+    expect(result.services.map((s) => s.name)).toEqual(catalog)
+  })
+
+  it('pins every service in a batch', () => {
+    const result = buildPreviewValues(
+      'slug',
+      [
+        { name: 'backend-1', commitSha: 'sha1' },
+        { name: 'front', commitSha: 'sha3' },
+      ],
+      ['backend-1', 'backend-2', 'front'],
+      testMetadata,
+    )
+    expect(result.services.map((s) => s.commitSha)).toEqual(['sha1', undefined, 'sha3'])
+  })
+})
+
+describe('buildServiceMetadata', () => {
+  it('maps action inputs to metadata keys', () => {
+    expect(testMetadata).toEqual({
+      'pr-author': 'dev',
+      'pr-url': 'https://github.com/owner/repo/pull/1',
+      'pr-number': '1',
+      'created-at': '2026-02-20T10:00:00Z',
+      'updated-at': '2026-02-20T10:00:00Z',
+      'vcs.ref.name': 'feature/my-branch',
+      'cicd.pipeline.run.url': 'https://github.com/owner/repo/actions/runs/123',
+    })
+  })
+})
+
+describe('updatePreviewValues', () => {
+  const baseMetadata = {
+    'created-at': '2026-01-01T00:00:00Z',
+    'updated-at': '',
+    'pr-author': '',
+    'pr-url': '',
+    'pr-number': '',
+    'vcs.ref.name': '',
+    'cicd.pipeline.run.url': '',
+  }
+
+  it('updates commitSha of existing service', () => {
+    const existing = {
+      services: [{ name: 'backend-1', commitSha: 'old-sha', metadata: { ...baseMetadata } }],
+    }
+    const result = updatePreviewValues(
+      existing,
+      [{ name: 'backend-1', commitSha: 'new-sha' }],
+      testMetadata,
+    )
+    expect(result.services[0].commitSha).toBe('new-sha')
+  })
+
+  it('preserves created-at from existing metadata', () => {
+    const createdAt = '2026-01-01T00:00:00Z'
+    const existing = {
+      services: [
+        {
+          name: 'backend-1',
+          commitSha: 'old',
+          metadata: { ...baseMetadata, 'created-at': createdAt },
+        },
+      ],
+    }
+    const result = updatePreviewValues(
+      existing,
+      [{ name: 'backend-1', commitSha: 'new' }],
+      testMetadata,
+    )
+    expect(result.services[0].metadata?.['created-at']).toBe(createdAt)
+  })
+
+  it('sets updated-at to new timestamp', () => {
+    const existing = {
+      services: [{ name: 'backend-1', commitSha: 'old', metadata: { ...baseMetadata } }],
+    }
+    const result = updatePreviewValues(
+      existing,
+      [{ name: 'backend-1', commitSha: 'new' }],
+      testMetadata,
+    )
+    expect(result.services[0].metadata?.['updated-at']).toBe(testInputs.timestamp)
+  })
+
+  it('does not share the metadata object between services', () => {
+    const existing = { services: [] }
+    const result = updatePreviewValues(
+      existing,
+      [
+        { name: 'backend-1', commitSha: 'sha1' },
+        { name: 'backend-2', commitSha: 'sha2' },
+      ],
+      testMetadata,
+    )
+    expect(result.services[0].metadata).not.toBe(result.services[1].metadata)
+    expect(result.services[0].metadata).not.toBe(testMetadata)
+  })
+
+  it('appends new service if not in existing list', () => {
+    const existing = { services: [{ name: 'backend-1', commitSha: 'sha' }] }
+    const result = updatePreviewValues(
+      existing,
+      [{ name: 'backend-2', commitSha: 'sha2' }],
+      testMetadata,
+    )
+    expect(result.services).toHaveLength(2)
+    expect(result.services[1].name).toBe('backend-2')
+    expect(result.services[1].commitSha).toBe('sha2')
+  })
+
+  it('does not change other services when updating one', () => {
+    const existing = {
+      services: [
+        { name: 'backend-1', commitSha: 'sha1', metadata: { ...baseMetadata } },
+        { name: 'backend-2', commitSha: 'sha2' },
+      ],
+    }
+    const result = updatePreviewValues(
+      existing,
+      [{ name: 'backend-1', commitSha: 'new-sha' }],
+      testMetadata,
+    )
+    expect(result.services[1].commitSha).toBe('sha2')
+  })
+
+  it('applies every update in a batch', () => {
+    const existing = {
+      services: [
+        { name: 'backend-1', commitSha: 'sha1' },
+        { name: 'backend-2', commitSha: 'sha2' },
+      ],
+    }
+    const result = updatePreviewValues(
+      existing,
+      [
+        { name: 'backend-1', commitSha: 'new1' },
+        { name: 'front', commitSha: 'new3' },
+      ],
+      testMetadata,
+    )
+    expect(result.services.map((s) => s.commitSha)).toEqual(['new1', 'sha2', 'new3'])
+  })
+
+  it('applies a later update to a service appended earlier in the batch', () => {
+    const existing = { services: [{ name: 'backend-1', commitSha: 'sha1' }] }
+    const result = updatePreviewValues(
+      existing,
+      [
+        { name: 'front', commitSha: 'first' },
+        { name: 'front', commitSha: 'second' },
+      ],
+      testMetadata,
+    )
+    expect(result.services).toHaveLength(2)
+    expect(result.services[1].commitSha).toBe('second')
+  })
+})
+
+describe('parseYaml', () => {
+  it('keeps unquoted timestamps as strings', () => {
+    expect(parseYaml('created-at: 2026-01-01T00:00:00Z\n')).toEqual({
+      'created-at': '2026-01-01T00:00:00Z',
+    })
+  })
+
+  it('resolves merge keys so they are not dumped back literally', () => {
+    const raw = [
+      'common: &common',
+      '  pr-author: dev',
+      'services:',
+      '  - name: backend-1',
+      '    metadata:',
+      '      <<: *common',
+      '      pr-number: "1"',
+      '',
+    ].join('\n')
+    const parsed = parseYaml(raw) as PreviewValues
+    expect(parsed.services[0].metadata).toEqual({ 'pr-author': 'dev', 'pr-number': '1' })
+    expect(dumpYaml(parsed)).not.toContain('<<')
+  })
+})
+
+describe('parseCatalog', () => {
+  it('returns serviceRepos keys in order', () => {
+    const raw = 'serviceRepos:\n  front: {}\n  backend-1: {}\n'
+    expect(parseCatalog(raw)).toEqual(['front', 'backend-1'])
+  })
+
+  it('resolves merge keys instead of listing them as services', () => {
+    const raw = [
+      'defaults: &defaults',
+      '  backend-1: {}',
+      'serviceRepos:',
+      '  <<: *defaults',
+      '  front: {}',
+      '',
+    ].join('\n')
+    expect(parseCatalog(raw)).toEqual(['backend-1', 'front'])
+  })
+
+  it('rejects files without serviceRepos', () => {
+    expect(() => parseCatalog('services: []\n')).toThrow("missing 'serviceRepos' key")
+  })
+})
+
+describe('parseServiceUpdates', () => {
+  it('returns an empty list for empty input', () => {
+    expect(parseServiceUpdates('')).toEqual([])
+  })
+
+  it('parses a JSON array of updates', () => {
+    expect(parseServiceUpdates('[{"name":"front","commitSha":"abc"}]')).toEqual([
+      { name: 'front', commitSha: 'abc' },
+    ])
+  })
+
+  it('rejects non-array JSON', () => {
+    expect(() => parseServiceUpdates('{"name":"front"}')).toThrow('must be a JSON array')
+  })
+
+  it('rejects entries without commitSha', () => {
+    expect(() => parseServiceUpdates('[{"name":"front"}]')).toThrow('service-updates[0]')
+  })
+})
+
+describe('resolveServiceUpdates', () => {
+  it('falls back to service-name and commit-sha', () => {
+    expect(resolveServiceUpdates(testInputs)).toEqual([
+      { name: 'backend-1', commitSha: 'abc123def456' },
+    ])
+  })
+
+  it('prefers service-updates when set', () => {
+    const serviceUpdates = [{ name: 'front', commitSha: 'sha' }]
+    expect(resolveServiceUpdates({ ...testInputs, serviceUpdates })).toEqual(serviceUpdates)
+  })
+})
+
+describe('parsePrUrl', () => {
+  it('extracts owner and repo from a PR URL', () => {
+    expect(parsePrUrl('https://github.com/owner/repo/pull/42')).toEqual({
+      owner: 'owner',
+      repo: 'repo',
+    })
+  })
+
+  it('returns undefined for non-PR URLs', () => {
+    expect(parsePrUrl('https://github.com/owner/repo/issues/42')).toBeUndefined()
+    expect(parsePrUrl('')).toBeUndefined()
+  })
+})
+
+describe('formatSummaryRow', () => {
+  it('renders a tracking-main row without commitSha', () => {
+    expect(formatSummaryRow({ name: 'front' })).toBe('- **front** · 🔄 `main`')
+  })
+
+  it('keeps short shas intact', () => {
+    expect(formatSummaryRow({ name: 'front', commitSha: 'abc' })).toBe('- **front** · 📌 `abc`')
+  })
+})
+
+describe('buildSummary', () => {
+  it('renders header with slug', () => {
+    const config = { services: [] }
+    const summary = buildSummary('my-slug', config, 'chore: update', 'https://commit.url')
+    expect(summary).toContain('## 🚀 Preview: `my-slug`')
+  })
+
+  it('renders service as list item', () => {
+    const config = { services: [{ name: 'backend-1', commitSha: 'abc123def456' }] }
+    const summary = buildSummary('slug', config, 'msg', 'url')
+    expect(summary).toContain('- **backend-1**')
+  })
+
+  it('shows pinned sha as linked code when pr-url present', () => {
+    const config = {
+      services: [
+        {
+          name: 'backend-1',
+          commitSha: 'abc123def456',
+          metadata: {
+            'pr-url': 'https://github.com/owner/repo/pull/1',
+            'pr-number': '1',
+            'created-at': '',
+            'updated-at': '',
+            'pr-author': '',
+            'vcs.ref.name': '',
+            'cicd.pipeline.run.url': '',
+          },
+        },
+      ],
+    }
+    const summary = buildSummary('slug', config, 'msg', 'url')
+    expect(summary).toContain('📌 [`abc123de`](https://github.com/owner/repo/commit/abc123def456)')
+  })
+
+  it('shows pinned sha without link when no pr-url', () => {
+    const config = { services: [{ name: 'backend-1', commitSha: 'abc123def456' }] }
+    const summary = buildSummary('slug', config, 'msg', 'url')
+    expect(summary).toContain('📌 `abc123de`')
+    expect(summary).not.toContain('`abc123de`](')
+  })
+
+  it('shows tracking main for service without commitSha', () => {
+    const config = { services: [{ name: 'front' }] }
+    const summary = buildSummary('slug', config, 'msg', 'url')
+    expect(summary).toContain('🔄 `main`')
+  })
+
+  it('includes PR link when metadata present', () => {
+    const config = {
+      services: [
+        {
+          name: 'backend-1',
+          commitSha: 'abc123def456',
+          metadata: {
+            'pr-url': 'https://github.com/owner/repo/pull/42',
+            'pr-number': '42',
+            'created-at': '',
+            'updated-at': '',
+            'pr-author': '',
+            'vcs.ref.name': '',
+            'cicd.pipeline.run.url': '',
+          },
+        },
+      ],
+    }
+    const summary = buildSummary('slug', config, 'msg', 'url')
+    expect(summary).toContain('[PR #42](https://github.com/owner/repo/pull/42)')
+  })
+
+  it('renders one row per service in order', () => {
+    const config = {
+      services: [{ name: 'backend-1', commitSha: 'abc123def456' }, { name: 'front' }],
+    }
+    const lines = buildSummary('slug', config, 'msg', 'url').split('\n')
+    expect(lines.slice(2, 4)).toEqual([
+      '- **backend-1** · 📌 `abc123de`',
+      '- **front** · 🔄 `main`',
+    ])
+  })
+
+  it('includes gitops commit link', () => {
+    const config = { services: [] }
+    const summary = buildSummary('slug', config, 'chore: create preview', 'https://commit.url')
+    expect(summary).toContain('[chore: create preview](https://commit.url)')
+  })
+})
+
+describe('idempotencyKey', () => {
+  const updates = [{ name: 'backend-1', commitSha: 'abc' }]
+
+  it('is stable for the same inputs', () => {
+    const key = idempotencyKey('slug', updates, 'a: 1\n')
+    expect(idempotencyKey('slug', updates, 'a: 1\n')).toBe(key)
+  })
+
+  it('changes with the rendered content', () => {
+    expect(idempotencyKey('slug', updates, 'a: 1\n')).not.toBe(
+      idempotencyKey('slug', updates, 'a: 2\n'),
+    )
+  })
+
+  it('is 16 hex characters', () => {
+    expect(idempotencyKey('slug', updates, '')).toMatch(/^[0-9a-f]{16}$/)
+  })
+})
+
+describe('readIdempotencyKey', () => {
+  it('reads the trailer from a commit message', () => {
+    const message = 'chore(preview): update x in y\n\nIdempotency-Key: 0123456789abcdef'
+    expect(readIdempotencyKey(message)).toBe('0123456789abcdef')
+  })
+
+  it('returns undefined without a trailer', () => {
+    expect(readIdempotencyKey('chore(preview): update x in y')).toBeUndefined()
+  })
+})
@@ -1,109 +1,120 @@
 import * as core from '@actions/core'
 import * as github from '@actions/github'
 import { diffLines } from 'diff'
-import * as yaml from 'js-yaml'
-import { endGroup, postOrUpdatePrComment, startGroup, writeSummary } from './gha'
-import { ActionInputs, PreviewValues, ServiceEntry, ServiceMetadata } from './types'
+import {
+  debugContent,
+  endGroup,
+  HttpError,
+  isRateLimited,
+  notifyArgoCdWebhook,
+  postOrUpdatePrComment,
+  rateLimitDelayMs,
+  retryWithBackoff,
+  startGroup,
+  writeSummary,
+} from './gha'
+import {
+  buildPreviewValues,
+  buildPushEvent,
+  buildServiceMetadata,
+  buildSummary,
+  dumpYaml,
+  idempotencyKey,
+  parseCatalog,
+  parsePrUrl,
+  parseYaml,
+  readIdempotencyKey,
+  resolveServiceUpdates,
+  slugify,
+  updatePreviewValues,
+  withIdempotencyKey,
+} from './preview'
+import { ActionInputs, PreviewValues, ServiceUpdate } from './types'
 
-const MAX_RETRIES = 3
-
-export function slugify(branch: string): string {
-  return branch
-    .toLowerCase()
-    .replace(/[^a-z0-9]/g, '-')
-    .replace(/-+/g, '-')
-    .replace(/^-|-$/g, '')
-}
-
-function buildServiceMetadata(inputs: ActionInputs): ServiceMetadata {
-  return {
-    'pr-author': inputs.prAuthor,
-    'pr-url': inputs.prUrl,
-    'pr-number': inputs.prNumber,
-    'created-at': inputs.timestamp,
-    'updated-at': inputs.timestamp,
-    'vcs.ref.name': inputs.headRef,
-    'cicd.pipeline.run.url': inputs.workflowRunUrl,
-  }
-}
+type Octokit = ReturnType<typeof github.getOctokit>
 
-export function buildPreviewValues(
-  slug: string,
-  serviceName: string,
-  commitSha: string,
-  catalog: string[],
-  inputs: ActionInputs,
-): PreviewValues {
-  const services: ServiceEntry[] = catalog.map((name) => {
-    const entry: ServiceEntry = { name }
-    if (name === serviceName) {
-      entry.commitSha = commitSha
-      entry.metadata = buildServiceMetadata(inputs)
-    }
-    return entry
-  })
-  return { services }
-}
+const MAX_RETRIES = 3
+// commitFile fast-forwards the whole branch, so any push to the gitops repo between the
+// read and the ref update conflicts, even one touching another preview. Several services
+// deploy to the same repo at once, so ref conflicts get a larger budget than other errors.
+const MAX_CONFLICT_ATTEMPTS = 5
 
-export function updatePreviewValues(
-  existing: PreviewValues,
-  serviceName: string,
-  commitSha: string,
-  inputs: ActionInputs,
-): PreviewValues {
-  const svc = existing.services.find((s) => s.name === serviceName)
-  if (svc) {
-    const existingCreatedAt = svc.metadata?.['created-at'] ?? ''
-    const metadata = buildServiceMetadata(inputs)
-    if (existingCreatedAt) {
-      metadata['created-at'] = existingCreatedAt
+// Default-branch head plus both files read at that commit, in a single round-trip.
+const SNAPSHOT_QUERY = `
+  query ($owner: String!, $repo: String!, $valuesPath: String!) {
+    repository(owner: $owner, name: $repo) {
+      url
+      defaultBranchRef {
+        name
+        target {
+          ... on Commit {
+            oid
+            url
+            tree {
+              oid
+            }
+            services: file(path: "services.yaml") {
+              object {
+                ... on Blob {
+                  oid
+                  text
+                }
+              }
+            }
+            values: file(path: $valuesPath) {
+              object {
+                ... on Blob {
+                  oid
+                  text
+                }
+              }
+            }
+            history(first: 1, path: $valuesPath) {
+              nodes {
+                oid
+                url
+                message
+                parents(first: 1) {
+                  nodes {
+                    oid
+                  }
+                }
+              }
+            }
+          }
+        }
+      }
     }
-    svc.commitSha = commitSha
-    svc.metadata = metadata
-  } else {
-    existing.services.push({
-      name: serviceName,
-      commitSha,
-      metadata: buildServiceMetadata(inputs),
-    })
   }
-  return existing
-}
+`
 
-function deriveCommitUrl(prUrl: string, sha: string): string {
-  const match = prUrl.match(/^(https:\/\/github\.com\/[^/]+\/[^/]+)\/pull\//)
-  return match ? `${match[1]}/commit/${sha}` : ''
+interface GitBlob {
+  oid: string
+  text: string | null
 }
 
-export function buildSummary(
-  slug: string,
-  config: PreviewValues,
-  commitMessage: string,
-  commitUrl: string,
-): string {
-  const lines: string[] = [`## 🚀 Preview: \`${slug}\``, '']
-  for (const svc of config.services) {
-    const sha = svc.commitSha
-    const prUrl = svc.metadata?.['pr-url'] ?? ''
-    const prNumber = svc.metadata?.['pr-number'] ?? ''
-    if (sha) {
-      const shaShort = sha.length >= 8 ? sha.slice(0, 8) : sha
-      const cUrl = deriveCommitUrl(prUrl, sha)
-      const commitPart = cUrl ? `📌 [\`${shaShort}\`](${cUrl})` : `📌 \`${shaShort}\``
-      const prPart = prUrl ? ` · [PR #${prNumber}](${prUrl})` : ''
-      lines.push(`- **${svc.name}** · ${commitPart}${prPart}`)
-    } else {
-      lines.push(`- **${svc.name}** · 🔄 \`main\``)
-    }
-  }
-  lines.push('')
-  lines.push('---')
-  lines.push(`🔗 [${commitMessage}](${commitUrl})`)
-  return lines.join('\n')
+interface LastCommitNode {
+  oid: string
+  url: string
+  message: string
+  parents: { nodes: { oid: string }[] }
 }
 
-function dumpYaml(config: PreviewValues): string {
-  return yaml.dump(config, { lineWidth: -1, sortKeys: false })
+interface SnapshotResponse {
+  repository: {
+    url: string
+    defaultBranchRef: {
+      name: string
+      target: {
+        oid: string
+        url: string
+        tree: { oid: string }
+        services: { object: GitBlob | null } | null
+        values: { object: GitBlob | null } | null
+        history: { nodes: LastCommitNode[] }
+      }
+    } | null
+  }
 }
 
 function logDiff(oldContent: string, newContent: string): void {
@@ -123,169 +134,354 @@ function logDiff(oldContent: string, newContent: string): void {
   }
 }
 
+function prKey(owner: string, repo: string, prNumber: string): string {
+  return `${owner}/${repo}#${prNumber}`.toLowerCase()
+}
+
 async function fanOutPrComments(
   config: PreviewValues,
   summary: string,
   token: string,
 ): Promise<void> {
   const octokit = github.getOctokit(token)
+  const pending: Promise<void>[] = []
+  const seen = new Set<string>()
   for (const svc of config.services) {
     const prUrl = svc.metadata?.['pr-url'] ?? ''
     const prNumber = svc.metadata?.['pr-number'] ?? ''
     if (!prUrl || !prNumber) continue
-    const match = prUrl.match(/^https:\/\/github\.com\/([^/]+)\/([^/]+)\/pull\//)
-    if (!match) continue
-    const [, svcOwner, svcRepo] = match
-    try {
-      await postOrUpdatePrComment(octokit, svcOwner, svcRepo, parseInt(prNumber), summary)
-    } catch (e) {
-      core.warning(`Could not comment on ${svcOwner}/${svcRepo}#${prNumber}: ${(e as Error).message}`)
-    }
+    const pr = parsePrUrl(prUrl)
+    if (!pr) continue
+    const { owner: svcOwner, repo: svcRepo } = pr
+    // Services sharing a PR would race to create the same comment
+    const key = prKey(svcOwner, svcRepo, prNumber)
+    if (seen.has(key)) continue
+    seen.add(key)
+    pending.push(
+      postOrUpdatePrComment(octokit, svcOwner, svcRepo, parseInt(prNumber), summary).catch((e) => {
+        const where = `${svcOwner}/${svcRepo}#${prNumber}`
+        core.warning(`Could not comment on ${where}: ${(e as Error).message}`)
+      }),
+    )
   }
+  // Comments target different PRs and never fail the run, so post them concurrently
+  await Promise.all(pending)
 }
 
-export async function main(inputs: ActionInputs): Promise<void> {
-  const { gitopsRepo, gitopsToken, serviceName, headRef, commitSha } = inputs
+interface BranchHead {
+  name: string
+  sha: string
+  treeSha: string
+  htmlUrl: string
+}
 
-  if (!gitopsRepo || !gitopsRepo.includes('/')) {
-    throw new Error("GITOPS_REPO must be set in 'owner/repo' format.")
+interface GitopsSnapshot {
+  repoUrl: string
+  head: BranchHead
+  services?: GitBlob
+  values?: GitBlob
+  lastValuesCommit?: LastCommitNode
+}
+
+async function readSnapshot(
+  octokit: Octokit,
+  owner: string,
+  repo: string,
+  valuesPath: string,
+): Promise<GitopsSnapshot> {
+  const { repository } = await octokit.graphql<SnapshotResponse>(SNAPSHOT_QUERY, {
+    owner,
+    repo,
+    valuesPath,
+  })
+  const branch = repository.defaultBranchRef
+  if (!branch) {
+    throw new Error(`${owner}/${repo} has no default branch`)
   }
+  const { target } = branch
+  return {
+    repoUrl: repository.url,
+    head: { name: branch.name, sha: target.oid, treeSha: target.tree.oid, htmlUrl: target.url },
+    services: target.services?.object ?? undefined,
+    values: target.values?.object ?? undefined,
+    lastValuesCommit: target.history.nodes[0],
+  }
+}
 
-  const [owner, repo] = gitopsRepo.split('/', 2)
-  const octokit = github.getOctokit(gitopsToken)
+// Single-file commit through the Git Data API. The ref update is not forced, so a
+// concurrent push to the branch surfaces as a 409 conflict instead of being overwritten.
+async function commitFile(
+  octokit: Octokit,
+  owner: string,
+  repo: string,
+  head: BranchHead,
+  filePath: string,
+  content: string,
+  message: string,
+): Promise<{ sha: string; htmlUrl: string }> {
+  const { data: blob } = await octokit.rest.git.createBlob({
+    owner,
+    repo,
+    content,
+    encoding: 'utf-8',
+  })
+  const { data: tree } = await octokit.rest.git.createTree({
+    owner,
+    repo,
+    base_tree: head.treeSha,
+    tree: [{ path: filePath, mode: '100644', type: 'blob', sha: blob.sha }],
+  })
+  const { data: commit } = await octokit.rest.git.createCommit({
+    owner,
+    repo,
+    message,
+    tree: tree.sha,
+    parents: [head.sha],
+  })
+  try {
+    await octokit.rest.git.updateRef({ owner, repo, ref: `heads/${head.name}`, sha: commit.sha })
+  } catch (e) {
+    // Only here is a 422 a retryable non-fast-forward; from createTree/createCommit it is
+    // a validation error, so the branch move is reported as a 409 conflict instead.
+    if ((e as { status?: number }).status === 422) {
+      const conflict = new Error(`${head.name} moved since ${head.sha} was read`, { cause: e })
+      throw Object.assign(conflict, { status: 409 })
+    }
+    throw e
+  }
+  return { sha: commit.sha, htmlUrl: commit.html_url }
+}
 
-  // Fetch service catalog from services.yaml
+// Service catalog from services.yaml, checked against the requested updates.
+function loadCatalog(
+  snapshot: GitopsSnapshot,
+  gitopsRepo: string,
+  updates: ServiceUpdate[],
+): string[] {
   startGroup('Fetching services.yaml')
   let catalog: string[]
   try {
-    const { data } = await octokit.rest.repos.getContent({ owner, repo, path: 'services.yaml' })
-    if (Array.isArray(data) || data.type !== 'file') {
-      throw new Error('services.yaml is not a file')
+    if (!snapshot.services) {
+      throw new Error(`services.yaml not found in ${gitopsRepo}`)
     }
-    const raw = Buffer.from(data.content, 'base64').toString('utf-8')
-    core.debug(raw)
-    const parsed = yaml.load(raw)
-    if (typeof parsed !== 'object' || parsed === null || !('serviceRepos' in parsed)) {
-      throw new Error("services.yaml missing 'serviceRepos' key")
-    }
-    catalog = Object.keys((parsed as { serviceRepos: Record<string, unknown> }).serviceRepos)
+    const raw = snapshot.services.text ?? ''
+    debugContent(raw)
+    catalog = parseCatalog(raw)
     core.info(`Catalog: ${catalog.join(', ')}`)
-  } catch (e) {
+  } finally {
     endGroup()
-    if ((e as { status?: number }).status === 404) {
-      throw new Error(`services.yaml not found in ${gitopsRepo}`, { cause: e })
+  }
+
+  const catalogSet = new Set(catalog)
+  for (const { name } of updates) {
+    if (!catalogSet.has(name)) {
+      throw new Error(
+        `Service '${name}' not found in services.yaml. Available: ${catalog.join(', ')}`,
+      )
     }
-    throw e
   }
-  endGroup()
+  return catalog
+}
 
-  if (!catalog.includes(serviceName)) {
-    throw new Error(
-      `Service '${serviceName}' not found in services.yaml. Available: ${catalog.join(', ')}`,
-    )
+interface PushResult {
+  config: PreviewValues
+  commitMessage: string
+  commitUrl: string
+  commitSha: string
+  parentSha: string
+  created: boolean
+  changed: boolean
+  repoUrl: string
+  branch: string
+}
+
+export async function main(inputs: ActionInputs): Promise<void> {
+  const { gitopsRepo, gitopsToken, headRef } = inputs
+
+  if (!gitopsRepo || !gitopsRepo.includes('/')) {
+    throw new Error("GITOPS_REPO must be set in 'owner/repo' format.")
   }
 
+  const updates = resolveServiceUpdates(inputs)
+  if (updates.length === 0) {
+    throw new Error('Either service-name and commit-sha, or service-updates, must be set.')
+  }
+  const serviceNames = updates.map((u) => u.name).join(', ')
+  const metadata = buildServiceMetadata(inputs)
+
+  const [owner, repo] = gitopsRepo.split('/', 2)
+  const octokit = github.getOctokit(gitopsToken)
+
   const slug = slugify(headRef)
   core.info(`Branch: ${headRef} -> Slug: ${slug}`)
 
   const filePath = `previews/${slug}/values.yaml`
-  let exists = false
-  let fileSha: string | undefined
-  let config: PreviewValues
-  let oldContent: string | undefined
 
-  // Try to get existing file
-  startGroup(`Current state: ${filePath}`)
+  // Push to gitops repo, re-reading and retrying with backoff when the branch moved under us
+  // or the request failed in flight
+  let pushed: PushResult
+  let lastAttempt: { key: string; result: PushResult } | undefined
   try {
-    const { data } = await octokit.rest.repos.getContent({ owner, repo, path: filePath })
-    if (Array.isArray(data) || data.type !== 'file') throw new Error('Not a file')
-    exists = true
-    fileSha = data.sha
-    oldContent = Buffer.from(data.content, 'base64').toString('utf-8')
-    core.debug(oldContent)
-    config = updatePreviewValues(
-      yaml.load(oldContent) as PreviewValues,
-      serviceName,
-      commitSha,
-      inputs,
+    pushed = await retryWithBackoff(
+      async (attempt) => {
+        core.info(`Attempt ${attempt}`)
+        // Read inside the retry so transient failures on the first read are retried too
+        const snapshot = await readSnapshot(octokit, owner, repo, filePath)
+        const landed = snapshot.lastValuesCommit
+        if (lastAttempt && landed && readIdempotencyKey(landed.message) === lastAttempt.key) {
+          core.info(`Previous attempt already landed as ${landed.oid}, not committing again`)
+          return {
+            ...lastAttempt.result,
+            commitUrl: landed.url,
+            commitSha: landed.oid,
+            parentSha: landed.parents.nodes[0]?.oid ?? '',
+          }
+        }
+        const catalog = loadCatalog(snapshot, gitopsRepo, updates)
+        const { head } = snapshot
+
+        // The existing file was read at the parent commit, so the new tree is based on it
+        let config: PreviewValues
+        const oldContent = snapshot.values?.text ?? undefined
+        startGroup(`Current state: ${filePath}`)
+        if (oldContent !== undefined) {
+          debugContent(oldContent)
+          config = updatePreviewValues(parseYaml(oldContent) as PreviewValues, updates, metadata)
+        } else {
+          core.info(`No existing preview for slug: ${slug}`)
+          config = buildPreviewValues(slug, updates, catalog, metadata)
+        }
+        endGroup()
+
+        const yamlContent = dumpYaml(config)
+
+        if (oldContent !== undefined) {
+          startGroup(`Diff: ${filePath}`)
+          logDiff(oldContent, yamlContent)
+          endGroup()
+        } else {
+          startGroup(`Creating ${filePath}`)
+          debugContent(yamlContent)
+          endGroup()
+        }
+
+        // Re-runs of the same workflow render identical values: skip the empty commit
+        // (and the ArgoCD reconciliation it would trigger). Link the commit that last wrote
+        // this file; the branch head usually belongs to another preview.
+        if (yamlContent === oldContent) {
+          const lastCommit = snapshot.lastValuesCommit
+          return {
+            config,
+            commitMessage: `No changes to ${filePath}`,
+            commitUrl: lastCommit?.url ?? head.htmlUrl,
+            commitSha: lastCommit?.oid ?? head.sha,
+            parentSha: head.sha,
+            created: false,
+            changed: false,
+            repoUrl: snapshot.repoUrl,
+            branch: head.name,
+          }
+        }
+
+        const commitMessage =
+          oldContent !== undefined
+            ? `chore(preview): update ${serviceNames} in ${slug}`
+            : `chore(preview): create ${slug} preview`
+        const key = idempotencyKey(slug, updates, yamlContent)
+        const result: PushResult = {
+          config,
+          commitMessage,
+          commitUrl: '',
+          commitSha: '',
+          parentSha: head.sha,
+          created: oldContent === undefined,
+          changed: true,
+          repoUrl: snapshot.repoUrl,
+          branch: head.name,
+        }
+        lastAttempt = { key, result }
+        const commit = await commitFile(
+          octokit,
+          owner,
+          repo,
+          head,
+          filePath,
+          yamlContent,
+          withIdempotencyKey(commitMessage, key),
+        )
+        return { ...result, commitUrl: commit.htmlUrl, commitSha: commit.sha }
+      },
+      {
+        maxAttempts: MAX_RETRIES,
+        maxAttemptsByStatus: { 409: MAX_CONFLICT_ATTEMPTS },
+        retryOn: [409, 403, 429, 500, 502, 503, 504],
+      },
     )
   } catch (e) {
-    if ((e as { status?: number }).status !== 404) {
-      endGroup()
-      throw e
+    const { status, response } = e as HttpError
+    if (status === 409) {
+      throw new Error(`Failed to push after ${MAX_CONFLICT_ATTEMPTS} attempts`, { cause: e })
+    }
+    // A rate-limited 403/429 that outlasted the retries is not a permissions problem
+    const headers = response?.headers ?? {}
+    if ((status === 403 || status === 429) && isRateLimited(headers)) {
+      const now = Date.now()
+      const delay = rateLimitDelayMs(headers, now)
+      const reset = delay !== undefined ? new Date(now + delay).toISOString() : 'unknown'
+      throw new Error(`GitHub API rate limit exceeded for ${gitopsRepo} (resets at ${reset})`, {
+        cause: e,
+      })
     }
-    core.info(`No existing preview for slug: ${slug}`)
-    config = buildPreviewValues(slug, serviceName, commitSha, catalog, inputs)
+    if (status === 401 || status === 403) {
+      throw new Error(`GITOPS_TOKEN lacks write access to ${gitopsRepo} (HTTP ${status})`, {
+        cause: e,
+      })
+    }
+    throw e
   }
-  endGroup()
 
-  let yamlContent = dumpYaml(config)
-
-  if (exists && oldContent !== undefined) {
-    startGroup(`Diff: ${filePath}`)
-    logDiff(oldContent, yamlContent)
-    endGroup()
+  const { config, commitMessage, commitUrl, changed } = pushed
+  // Post-push side effects are independent network calls; run them concurrently
+  const sideEffects: Promise<void>[] = []
+  if (changed) {
+    core.notice(`Successfully pushed values.yaml: ${commitUrl}`)
+    if (inputs.argocdWebhookUrl) {
+      const event = buildPushEvent(
+        pushed.repoUrl,
+        pushed.branch,
+        pushed.parentSha,
+        pushed.commitSha,
+        filePath,
+        pushed.created,
+      )
+      sideEffects.push(
+        notifyArgoCdWebhook(inputs.argocdWebhookUrl, inputs.argocdWebhookSecret ?? '', event),
+      )
+    }
   } else {
-    startGroup(`Creating ${filePath}`)
-    core.debug(yamlContent)
-    endGroup()
+    core.notice(`No changes to ${filePath}; skipping push`)
   }
-
-  // Push to gitops repo with retry on 409
-  for (let attempt = 1; attempt <= MAX_RETRIES; attempt++) {
-    core.info(`Attempt ${attempt} of ${MAX_RETRIES}`)
-    try {
-      const contentBase64 = Buffer.from(yamlContent).toString('base64')
-      const isUpdate = exists && fileSha !== undefined
-      const commitMessage = isUpdate
-        ? `chore(preview): update ${serviceName} in ${slug}`
-        : `chore(preview): create ${slug} preview`
-
-      const { data } = await octokit.rest.repos.createOrUpdateFileContents({
-        owner,
-        repo,
-        path: filePath,
-        message: commitMessage,
-        content: contentBase64,
-        ...(isUpdate ? { sha: fileSha } : {}),
-      })
-
-      const commitUrl = data.commit.html_url ?? ''
-      core.notice(`Successfully pushed values.yaml: ${commitUrl}`)
-      core.setOutput('preview-slug', slug)
-      core.setOutput('gitops-commit-url', commitUrl)
-      const summary = buildSummary(slug, config, commitMessage, commitUrl)
-      await writeSummary(summary)
-      if (inputs.githubToken && inputs.prNumber) {
+  core.setOutput('preview-slug', slug)
+  core.setOutput('gitops-commit-url', commitUrl)
+  const summary = buildSummary(slug, config, commitMessage, commitUrl)
+  writeSummary(summary)
+  const { githubToken, prNumber } = inputs
+  sideEffects.push(
+    (async () => {
+      // The fan-out may update the triggering PR's comment too, so it waits for this one
+      if (githubToken && prNumber) {
         const { owner: srcOwner, repo: srcRepo } = github.context.repo
-        const srcOctokit = github.getOctokit(inputs.githubToken)
-        await postOrUpdatePrComment(srcOctokit, srcOwner, srcRepo, parseInt(inputs.prNumber), summary)
+        const srcOctokit = github.getOctokit(githubToken)
+        // Fork PRs get a read-only token; the push already landed, so only warn
+        try {
+          await postOrUpdatePrComment(srcOctokit, srcOwner, srcRepo, parseInt(prNumber), summary)
+        } catch (e) {
+          const where = `${srcOwner}/${srcRepo}#${prNumber}`
+          core.warning(`Could not comment on ${where}: ${(e as Error).message}`)
+        }
       }
       await fanOutPrComments(config, summary, gitopsToken)
-      return
-    } catch (e) {
-      const status = (e as { status?: number }).status
-      if (status === 409) {
-        core.warning('Conflict (409) — re-fetching file SHA and retrying...')
-        const { data } = await octokit.rest.repos.getContent({ owner, repo, path: filePath })
-        if (Array.isArray(data) || data.type !== 'file') throw new Error('Not a file', { cause: e })
-        fileSha = data.sha
-        exists = true
-        const freshConfig = yaml.load(
-          Buffer.from(data.content, 'base64').toString('utf-8'),
-        ) as PreviewValues
-        config = updatePreviewValues(freshConfig, serviceName, commitSha, inputs)
-        yamlContent = dumpYaml(config)
-        continue
-      }
-      if (status === 401 || status === 403) {
-        throw new Error(`GITOPS_TOKEN lacks write access to ${gitopsRepo} (HTTP ${status})`, {
-          cause: e,
-        })
-      }
-      throw e
-    }
-  }
-
-  throw new Error(`Failed to push after ${MAX_RETRIES} attempts`)
+    })(),
+  )
+  await Promise.all(sideEffects)
 }
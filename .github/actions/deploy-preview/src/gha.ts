@@ -1,10 +1,30 @@
 import * as core from '@actions/core'
 import type { getOctokit } from '@actions/github'
+import { createHmac } from 'crypto'
 
 type Octokit = ReturnType<typeof getOctokit>
 
 const PR_COMMENT_MARKER = '<!-- akpe-preview -->'
 
+const DEFAULT_RETRY_ON = [409, 403, 429]
+const MAX_RATE_LIMIT_WAIT_MS = 60_000
+const WEBHOOK_TIMEOUT_MS = 5_000
+
+type Headers = Record<string, string | number | undefined>
+
+export interface HttpError {
+  status?: number
+  response?: { headers?: Headers }
+}
+
+export interface RetryOptions {
+  maxAttempts: number
+  // Per-status attempt budgets that override maxAttempts, e.g. for expected conflicts
+  maxAttemptsByStatus?: Partial<Record<number, number>>
+  retryOn?: number[]
+  sleep?: (ms: number) => Promise<void>
+}
+
 export function startGroup(title: string): void {
   core.startGroup(title)
 }
@@ -13,8 +33,83 @@ export function endGroup(): void {
   core.endGroup()
 }
 
-export async function writeSummary(markdown: string): Promise<void> {
-  await core.summary.addRaw(markdown).write()
+// core.debug escapes and writes its message even when step debug logging is off,
+// so whole-file dumps are only emitted when it is actually enabled.
+export function debugContent(content: string): void {
+  if (core.isDebug()) {
+    core.debug(content)
+  }
+}
+
+function defaultSleep(ms: number): Promise<void> {
+  return new Promise((resolve) => setTimeout(resolve, ms))
+}
+
+export function isRateLimited(headers: Headers): boolean {
+  return headers['retry-after'] !== undefined || String(headers['x-ratelimit-remaining']) === '0'
+}
+
+// Delay requested by GitHub for primary/secondary rate limits, if any. A Retry-After that
+// is not a number of seconds (e.g. an HTTP date) is ignored in favour of the backoff.
+export function rateLimitDelayMs(headers: Headers, now = Date.now()): number | undefined {
+  const retryAfter = Number(headers['retry-after'])
+  if (headers['retry-after'] !== undefined && Number.isFinite(retryAfter)) {
+    return retryAfter * 1000
+  }
+  const reset = headers['x-ratelimit-reset']
+  if (String(headers['x-ratelimit-remaining']) === '0' && reset !== undefined) {
+    return Math.max(0, Number(reset) * 1000 - now)
+  }
+  return undefined
+}
+
+export async function retryWithBackoff<T>(
+  fn: (attempt: number) => Promise<T>,
+  {
+    maxAttempts,
+    maxAttemptsByStatus = {},
+    retryOn = DEFAULT_RETRY_ON,
+    sleep = defaultSleep,
+  }: RetryOptions,
+): Promise<T> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await fn(attempt)
+    } catch (e) {
+      const { status, response } = e as HttpError
+      if (status === undefined || !retryOn.includes(status)) throw e
+      const budget = maxAttemptsByStatus[status] ?? maxAttempts
+      if (attempt >= budget) throw e
+      const headers = response?.headers ?? {}
+      // A 403 is only transient when GitHub flags it as a rate limit
+      if (status === 403 && !isRateLimited(headers)) throw e
+      const rateLimitDelay = rateLimitDelayMs(headers)
+      if (rateLimitDelay !== undefined && rateLimitDelay > MAX_RATE_LIMIT_WAIT_MS) throw e
+      const delay = rateLimitDelay ?? 2 ** (attempt - 1) * 1000 + Math.random() * 1000
+      const seconds = (delay / 1000).toFixed(1)
+      core.warning(`HTTP ${status} (attempt ${attempt}/${budget}), retrying in ${seconds}s`)
+      await sleep(delay)
+    }
+  }
+}
+
+// Summaries are buffered in memory and written to $GITHUB_STEP_SUMMARY once, by flushSummary().
+export function writeSummary(markdown: string): void {
+  core.summary.addRaw(markdown, true)
+}
+
+export async function flushSummary(): Promise<void> {
+  if (core.summary.isEmptyBuffer()) return
+  if (!process.env.GITHUB_STEP_SUMMARY) {
+    core.info(core.summary.stringify())
+    core.summary.emptyBuffer()
+    return
+  }
+  try {
+    await core.summary.write()
+  } catch (e) {
+    core.warning(`Could not write step summary: ${(e as Error).message}`)
+  }
 }
 
 export async function postOrUpdatePrComment(
@@ -50,3 +145,38 @@ export async function postOrUpdatePrComment(
     })
   }
 }
+
+export function signWebhookBody(secret: string, body: string): string {
+  return `sha256=${createHmac('sha256', secret).update(body).digest('hex')}`
+}
+
+// Best effort: a failed notification only delays the sync until ArgoCD's next poll.
+export async function notifyArgoCdWebhook(
+  url: string,
+  secret: string,
+  payload: object,
+): Promise<void> {
+  const body = JSON.stringify(payload)
+  const headers: Record<string, string> = {
+    'content-type': 'application/json',
+    'x-github-event': 'push',
+  }
+  if (secret) {
+    headers['x-hub-signature-256'] = signWebhookBody(secret, body)
+  }
+  try {
+    const res = await fetch(url, {
+      method: 'POST',
+      headers,
+      body,
+      signal: AbortSignal.timeout(WEBHOOK_TIMEOUT_MS),
+    })
+    if (res.ok) {
+      core.info(`Notified ArgoCD webhook (HTTP ${res.status})`)
+    } else {
+      core.warning(`ArgoCD webhook returned HTTP ${res.status}`)
+    }
+  } catch (e) {
+    core.warning(`Could not notify ArgoCD webhook: ${(e as Error).message}`)
+  }
+}
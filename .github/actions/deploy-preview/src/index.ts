@@ -1,30 +1,34 @@
 import * as core from '@actions/core'
 import * as github from '@actions/github'
 import { main } from './deploy'
-import { postOrUpdatePrComment, writeSummary } from './gha'
+import { flushSummary, postOrUpdatePrComment, writeSummary } from './gha'
+import { parseServiceUpdates } from './preview'
 
 async function run(): Promise<void> {
   const inputs = {
     gitopsRepo: core.getInput('gitops-repo', { required: true }),
     gitopsToken: core.getInput('gitops-token', { required: true }),
-    serviceName: core.getInput('service-name', { required: true }),
+    serviceName: core.getInput('service-name'),
     headRef: core.getInput('head-ref', { required: true }),
-    commitSha: core.getInput('commit-sha', { required: true }),
+    commitSha: core.getInput('commit-sha'),
     prAuthor: core.getInput('pr-author'),
     prUrl: core.getInput('pr-url'),
     prNumber: core.getInput('pr-number'),
     timestamp: core.getInput('timestamp'),
     workflowRunUrl: core.getInput('workflow-run-url'),
     githubToken: core.getInput('github-token') || undefined,
+    argocdWebhookUrl: core.getInput('argocd-webhook-url') || undefined,
+    argocdWebhookSecret: core.getInput('argocd-webhook-secret') || undefined,
   }
 
   try {
-    await main(inputs)
+    const serviceUpdates = parseServiceUpdates(core.getInput('service-updates'))
+    await main({ ...inputs, serviceUpdates })
   } catch (error) {
     const message = error instanceof Error ? error.message : String(error)
     core.error(message)
     const failureSummary = `> ❌ Deploy failed: ${message}`
-    await writeSummary(failureSummary)
+    writeSummary(failureSummary)
     if (inputs.githubToken && inputs.prNumber) {
       const { owner, repo } = github.context.repo
       const octokit = github.getOctokit(inputs.githubToken)
@@ -35,6 +39,8 @@ async function run(): Promise<void> {
       }
     }
     core.setFailed(message)
+  } finally {
+    await flushSummary()
   }
 }
 
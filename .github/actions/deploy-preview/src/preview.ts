@@ -0,0 +1,210 @@
+import { createHash } from 'crypto'
+import * as yaml from 'js-yaml'
+import { ActionInputs, PreviewValues, ServiceEntry, ServiceMetadata, ServiceUpdate } from './types'
+
+const IDEMPOTENCY_TRAILER = 'Idempotency-Key'
+const IDEMPOTENCY_TRAILER_RE = /^Idempotency-Key: (\S+)$/m
+const PR_URL_RE = /^https:\/\/github\.com\/([^/]+)\/([^/]+)\/pull\//
+
+// CORE_SCHEMA skips the timestamp and binary resolvers, keeping unquoted dates as strings
+// instead of round-tripping them via Date. Merge keys (<<) stay supported, as an implicit
+// type so plain `<<:` resolves: services.yaml and values.yaml are hand-maintained.
+const YAML_SCHEMA = yaml.CORE_SCHEMA.extend({ implicit: [yaml.types.merge] })
+
+function isSlugChar(code: number): boolean {
+  return (code >= 0x61 && code <= 0x7a) || (code >= 0x30 && code <= 0x39)
+}
+
+// Single pass: runs of non [a-z0-9] become one '-', leading/trailing runs are dropped.
+export function slugify(branch: string): string {
+  const lower = branch.toLowerCase()
+  let slug = ''
+  let pendingDash = false
+  for (let i = 0; i < lower.length; i++) {
+    if (isSlugChar(lower.charCodeAt(i))) {
+      if (pendingDash && slug) slug += '-'
+      slug += lower[i]
+      pendingDash = false
+    } else {
+      pendingDash = true
+    }
+  }
+  return slug
+}
+
+export function buildServiceMetadata(inputs: ActionInputs): ServiceMetadata {
+  return {
+    'pr-author': inputs.prAuthor,
+    'pr-url': inputs.prUrl,
+    'pr-number': inputs.prNumber,
+    'created-at': inputs.timestamp,
+    'updated-at': inputs.timestamp,
+    'vcs.ref.name': inputs.headRef,
+    'cicd.pipeline.run.url': inputs.workflowRunUrl,
+  }
+}
+
+export function parseServiceUpdates(raw: string): ServiceUpdate[] {
+  if (!raw.trim()) return []
+  let parsed: unknown
+  try {
+    parsed = JSON.parse(raw)
+  } catch (e) {
+    throw new Error('service-updates must be a JSON array', { cause: e })
+  }
+  if (!Array.isArray(parsed)) {
+    throw new Error('service-updates must be a JSON array')
+  }
+  return parsed.map((item, i) => {
+    const { name, commitSha } = (item ?? {}) as Partial<ServiceUpdate>
+    if (typeof name !== 'string' || !name || typeof commitSha !== 'string' || !commitSha) {
+      throw new Error(`service-updates[${i}] must have non-empty 'name' and 'commitSha'`)
+    }
+    return { name, commitSha }
+  })
+}
+
+export function resolveServiceUpdates(inputs: ActionInputs): ServiceUpdate[] {
+  if (inputs.serviceUpdates && inputs.serviceUpdates.length > 0) {
+    return inputs.serviceUpdates
+  }
+  if (inputs.serviceName && inputs.commitSha) {
+    return [{ name: inputs.serviceName, commitSha: inputs.commitSha }]
+  }
+  return []
+}
+
+export function buildPreviewValues(
+  slug: string,
+  updates: ServiceUpdate[],
+  catalog: string[],
+  metadata: ServiceMetadata,
+): PreviewValues {
+  const updatesByName = new Map(updates.map((u) => [u.name, u]))
+  const services: ServiceEntry[] = catalog.map((name) => {
+    const entry: ServiceEntry = { name }
+    const update = updatesByName.get(name)
+    if (update) {
+      entry.commitSha = update.commitSha
+      entry.metadata = { ...metadata }
+    }
+    return entry
+  })
+  return { services }
+}
+
+export function updatePreviewValues(
+  existing: PreviewValues,
+  updates: ServiceUpdate[],
+  metadata: ServiceMetadata,
+): PreviewValues {
+  const servicesByName = new Map(existing.services.map((s) => [s.name, s]))
+  for (const { name, commitSha } of updates) {
+    const svc = servicesByName.get(name)
+    if (svc) {
+      const existingCreatedAt = svc.metadata?.['created-at'] ?? ''
+      svc.commitSha = commitSha
+      svc.metadata = existingCreatedAt
+        ? { ...metadata, 'created-at': existingCreatedAt }
+        : { ...metadata }
+    } else {
+      const entry: ServiceEntry = { name, commitSha, metadata: { ...metadata } }
+      existing.services.push(entry)
+      servicesByName.set(name, entry)
+    }
+  }
+  return existing
+}
+
+export function parsePrUrl(prUrl: string): { owner: string; repo: string } | undefined {
+  const match = prUrl.match(PR_URL_RE)
+  return match ? { owner: match[1], repo: match[2] } : undefined
+}
+
+function deriveCommitUrl(prUrl: string, sha: string): string {
+  const pr = parsePrUrl(prUrl)
+  return pr ? `https://github.com/${pr.owner}/${pr.repo}/commit/${sha}` : ''
+}
+
+export function formatSummaryRow(svc: ServiceEntry): string {
+  const sha = svc.commitSha
+  if (!sha) {
+    return `- **${svc.name}** · 🔄 \`main\``
+  }
+  const prUrl = svc.metadata?.['pr-url'] ?? ''
+  const prNumber = svc.metadata?.['pr-number'] ?? ''
+  const shaShort = sha.slice(0, 8)
+  const cUrl = deriveCommitUrl(prUrl, sha)
+  const commitPart = cUrl ? `📌 [\`${shaShort}\`](${cUrl})` : `📌 \`${shaShort}\``
+  const prPart = prUrl ? ` · [PR #${prNumber}](${prUrl})` : ''
+  return `- **${svc.name}** · ${commitPart}${prPart}`
+}
+
+export function buildSummary(
+  slug: string,
+  config: PreviewValues,
+  commitMessage: string,
+  commitUrl: string,
+): string {
+  return [
+    `## 🚀 Preview: \`${slug}\``,
+    '',
+    ...config.services.map(formatSummaryRow),
+    '',
+    '---',
+    `🔗 [${commitMessage}](${commitUrl})`,
+  ].join('\n')
+}
+
+export function parseYaml(raw: string): unknown {
+  return yaml.load(raw, { schema: YAML_SCHEMA })
+}
+
+// noRefs skips the duplicate-object scan; the values tree never shares objects.
+export function dumpYaml(config: PreviewValues): string {
+  return yaml.dump(config, { lineWidth: -1, sortKeys: false, noRefs: true })
+}
+
+export function parseCatalog(raw: string): string[] {
+  const parsed = parseYaml(raw)
+  if (typeof parsed !== 'object' || parsed === null || !('serviceRepos' in parsed)) {
+    throw new Error("services.yaml missing 'serviceRepos' key")
+  }
+  return Object.keys((parsed as { serviceRepos: Record<string, unknown> }).serviceRepos)
+}
+
+// Minimal GitHub push event, enough for ArgoCD's /api/webhook to refresh the apps
+// tracking the changed path without waiting for the next poll.
+export function buildPushEvent(
+  repoUrl: string,
+  branch: string,
+  before: string,
+  after: string,
+  filePath: string,
+  created: boolean,
+): object {
+  return {
+    ref: `refs/heads/${branch}`,
+    before,
+    after,
+    repository: { html_url: repoUrl, default_branch: branch },
+    commits: [
+      { id: after, added: created ? [filePath] : [], modified: created ? [] : [filePath] },
+    ],
+  }
+}
+
+// Deterministic key for one rendering of the values file; carried as a commit trailer so a
+// retry can tell that an earlier attempt already landed (e.g. the response was lost).
+export function idempotencyKey(slug: string, updates: ServiceUpdate[], content: string): string {
+  const services = updates.map((u) => `${u.name}@${u.commitSha}`).join(',')
+  return createHash('sha256').update(`${slug}|${services}|${content}`).digest('hex').slice(0, 16)
+}
+
+export function readIdempotencyKey(message: string): string | undefined {
+  return message.match(IDEMPOTENCY_TRAILER_RE)?.[1]
+}
+
+export function withIdempotencyKey(message: string, key: string): string {
+  return `${message}\n\n${IDEMPOTENCY_TRAILER}: ${key}`
+}
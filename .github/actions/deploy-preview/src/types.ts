@@ -14,6 +14,11 @@ export interface ServiceEntry {
   metadata?: ServiceMetadata
 }
 
+export interface ServiceUpdate {
+  name: string
+  commitSha: string
+}
+
 export interface PreviewValues {
   services: ServiceEntry[]
 }
@@ -30,4 +35,7 @@ export interface ActionInputs {
   timestamp: string
   workflowRunUrl: string
   githubToken?: string
+  serviceUpdates?: ServiceUpdate[]
+  argocdWebhookUrl?: string
+  argocdWebhookSecret?: string
 }